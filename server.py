@@ -1,15 +1,265 @@
-from http.server import HTTPServer, SimpleHTTPRequestHandler
-import json
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+import gzip
 import os
 import sys
 import time
 import importlib
-from threading import Thread
+from collections import OrderedDict
+from threading import Lock, Thread
+from urllib.parse import urlparse, parse_qs
+import orjson
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import filter as filter_module
 import pagination as pagination_module
 
+DATA_FILE = "data.jsonl"
+GZIP_LEVEL = 6
+
+# The raw file and parsed products are kept in memory and only reloaded when
+# the data file changes
+_data_lock = Lock()
+
+
+def _read_raw_data():
+    with open(DATA_FILE, "rb") as f:
+        return f.read()
+
+
+def _parse_products(raw_data):
+    """Parse JSONL bytes into a list of product dictionaries."""
+    return [orjson.loads(line) for line in raw_data.splitlines() if line.strip()]
+
+
+_raw_data = None
+_raw_data_gzip = None
+_all_products = None
+_products_error = None
+_data_mtime = None
+
+
+def _refresh_data():
+    """Reload the cached data if the data file has changed on disk."""
+    global _raw_data, _raw_data_gzip, _all_products, _products_error, _data_mtime
+    # Take the mtime before reading, so a change made while loading is picked
+    # up on the next refresh
+    mtime = os.path.getmtime(DATA_FILE)
+    if mtime == _data_mtime:
+        return
+    raw_data = _read_raw_data()
+    raw_data_gzip = gzip.compress(raw_data, compresslevel=GZIP_LEVEL)
+    # A bad line only breaks the product endpoints; the raw file can still be
+    # served as it is
+    try:
+        all_products = _parse_products(raw_data)
+        products_error = None
+    except ValueError as e:
+        all_products = None
+        products_error = f"Could not parse {DATA_FILE}: {e}"
+        print(products_error)
+    # Everything comes from the same read and is swapped in together
+    _raw_data = raw_data
+    _raw_data_gzip = raw_data_gzip
+    _all_products = all_products
+    _products_error = products_error
+    _data_mtime = mtime
+    _clear_filter_cache()
+
+
+def _get_shared_products():
+    """Return the cached product list itself. Callers must not modify it."""
+    with _data_lock:
+        _refresh_data()
+        if _all_products is None:
+            raise ValueError(_products_error)
+        return _all_products
+
+
+def _get_products():
+    """Return a copy of the cached product list, safe to sort in place."""
+    return list(_get_shared_products())
+
+
+def _invalidate_data():
+    """Force the data to be reloaded on the next request."""
+    global _data_mtime
+    with _data_lock:
+        _data_mtime = None
+
+
+def _encode_jsonl(products):
+    """Encode products as JSONL into a single buffer, ready to be sent."""
+    buf = bytearray()
+    extend = buf.extend
+    for product in products:
+        extend(orjson.dumps(product))
+        extend(b"\n")
+    # Lines are separated by newlines, with no trailing newline
+    if buf:
+        del buf[-1:]
+    return buf
+
+
+def _get_raw_data():
+    """Return the unfiltered data file contents as bytes."""
+    with _data_lock:
+        _refresh_data()
+        return _raw_data
+
+
+def _get_raw_data_gzip():
+    """Return the gzip-compressed unfiltered data file contents."""
+    with _data_lock:
+        _refresh_data()
+        return _raw_data_gzip
+
+
+# Filtered and sorted results, keyed by the filters that produced them
+FILTER_CACHE_SIZE = 32
+_filter_cache = OrderedDict()
+_gzip_cache = OrderedDict()
+_filter_cache_lock = Lock()
+# Bumped whenever the caches are cleared, so results computed before a clear
+# are not stored afterwards
+_filter_cache_generation = 0
+
+
+def _filter_cache_key(filters):
+    return orjson.dumps(filters, option=orjson.OPT_SORT_KEYS)
+
+
+def _get_cached_filter_result(key):
+    with _filter_cache_lock:
+        result = _filter_cache.get(key)
+        if result is not None:
+            _filter_cache.move_to_end(key)
+        return result
+
+
+def _get_filter_cache_generation():
+    with _filter_cache_lock:
+        return _filter_cache_generation
+
+
+def _store_filter_result(key, products, generation):
+    with _filter_cache_lock:
+        # The data or filter code changed while this result was computed
+        if generation != _filter_cache_generation:
+            return
+        _filter_cache[key] = products
+        _filter_cache.move_to_end(key)
+        while len(_filter_cache) > FILTER_CACHE_SIZE:
+            _filter_cache.popitem(last=False)
+
+
+def _get_filtered_gzip(filters, products):
+    """Return the gzip-compressed JSONL for a cached filter result."""
+    key = _filter_cache_key(filters)
+    with _filter_cache_lock:
+        entry = _gzip_cache.get(key)
+        if entry is not None:
+            _gzip_cache.move_to_end(key)
+    # Only reuse the compressed body if it was built from this exact result
+    if entry is not None and entry[0] is products:
+        return entry[1]
+    data = gzip.compress(_encode_jsonl(products), compresslevel=GZIP_LEVEL)
+    with _filter_cache_lock:
+        _gzip_cache[key] = (products, data)
+        _gzip_cache.move_to_end(key)
+        while len(_gzip_cache) > FILTER_CACHE_SIZE:
+            _gzip_cache.popitem(last=False)
+    return data
+
+
+def _clear_filter_cache():
+    global _filter_cache_generation
+    with _filter_cache_lock:
+        _filter_cache_generation += 1
+        _filter_cache.clear()
+        _gzip_cache.clear()
+
+
+# Sort options from the page, mapped to the filter.py function that applies
+# them. Functions are looked up by name so auto-reloaded code is picked up.
+SORTERS = {
+    "price_high_to_low": "sort_by_price_high_to_low",
+    "price_low_to_high": "sort_by_price_low_to_high",
+    "popularity": "sort_by_popularity",
+}
+
+# Filters set from the page, or None when no filters are active
+_current_filters = None
+_filters_lock = Lock()
+
+
+def _get_current_filters():
+    """Return the active filters, or None if no filters are set."""
+    with _filters_lock:
+        return _current_filters
+
+
+def _filters_are_empty(filters):
+    """Return True if the filters would leave the product list unchanged."""
+    return (
+        not any(
+            filters.get(key) for key in ("color", "brand", "price_range", "sort_by")
+        )
+        # on_sale=False is a real filter, so only None counts as unset
+        and filters.get("on_sale") is None
+    )
+
+
+def _set_current_filters(filters):
+    global _current_filters
+    # Empty filters are served the same way as no filters, from the raw data
+    if filters is not None and _filters_are_empty(filters):
+        filters = None
+    with _filters_lock:
+        _current_filters = filters
+
+
+def _get_filtered_products(filters):
+    """Apply the filters and sorting using the filter.py functions."""
+    generation = _get_filter_cache_generation()
+    # Refreshes the data (clearing stale results) without copying it yet
+    all_products = _get_shared_products()
+
+    # Reuse the result if these filters have already been applied
+    cache_key = _filter_cache_key(filters)
+    filtered_products = _get_cached_filter_result(cache_key)
+    if filtered_products is not None:
+        return filtered_products
+
+    # Student code may sort in place, so it gets its own copy
+    all_products = list(all_products)
+
+    # Apply filters using the filter.py functions
+    color = filters.get("color") or None
+    brand = filters.get("brand") or None
+    on_sale = filters.get("on_sale") if filters.get("on_sale") is not None else None
+
+    # Parse price range
+    price_range = None
+    if filters.get("price_range"):
+        price_parts = filters["price_range"].split("-")
+        price_range = (float(price_parts[0]), float(price_parts[1]))
+
+    # Apply the filters
+    filtered_products = filter_module.apply_filters(
+        all_products,
+        color=color,
+        price_range=price_range,
+        on_sale=on_sale,
+        brand=brand,
+    )
+
+    # Apply sorting if specified
+    sorter_name = SORTERS.get(filters.get("sort_by"))
+    if sorter_name is not None:
+        filtered_products = getattr(filter_module, sorter_name)(filtered_products)
+    _store_filter_result(cache_key, filtered_products, generation)
+    return filtered_products
+
 
 # Auto-reload handler
 class ReloadHandler(FileSystemEventHandler):
@@ -28,76 +278,63 @@ class ReloadHandler(FileSystemEventHandler):
                         print(f"Reloaded {module.__name__}")
                     except Exception as e:
                         print(f"Error reloading {module.__name__}: {e}")
+                # Cached data and results may have been changed by the old code
+                _invalidate_data()
+                _clear_filter_cache()
                 print("✨ Ready for requests!\n")
                 self.last_reload = time.time()
 
 
 class Handler(SimpleHTTPRequestHandler):
+    def _accepts_gzip(self):
+        # Parse e.g. "gzip, deflate;q=0.5" and honour q=0 as "not acceptable"
+        qualities = {}
+        for token in self.headers.get("Accept-Encoding", "").split(","):
+            coding, _, params = token.partition(";")
+            quality = 1.0
+            for param in params.split(";"):
+                name, _, value = param.partition("=")
+                if name.strip().lower() == "q":
+                    try:
+                        quality = float(value)
+                    except ValueError:
+                        quality = 0.0
+            qualities[coding.strip().lower()] = quality
+        if "gzip" in qualities:
+            return qualities["gzip"] > 0
+        return qualities.get("*", 0) > 0
+
     def do_GET(self):
         if self.path == "/data.jsonl":
+            use_gzip = self._accepts_gzip()
+
             # Check if there are active filters
-            if os.path.exists("current_filters.json"):
-                with open("current_filters.json", "r") as f:
-                    filters = json.load(f)
-
-                # Load all products
-                all_products = filter_module.load_products("data.jsonl")
-
-                # Apply filters using the filter.py functions
-                color = filters.get("color") or None
-                brand = filters.get("brand") or None
-                on_sale = (
-                    filters.get("on_sale")
-                    if filters.get("on_sale") is not None
-                    else None
-                )
-
-                # Parse price range
-                price_range = None
-                if filters.get("price_range"):
-                    price_parts = filters["price_range"].split("-")
-                    price_range = (float(price_parts[0]), float(price_parts[1]))
-
-                # Apply the filters
-                filtered_products = filter_module.apply_filters(
-                    all_products,
-                    color=color,
-                    price_range=price_range,
-                    on_sale=on_sale,
-                    brand=brand,
-                )
-
-                # Apply sorting if specified
-                sort_by = filters.get("sort_by")
-                if sort_by == "price_high_to_low":
-                    filtered_products = filter_module.sort_by_price_high_to_low(
-                        filtered_products
-                    )
-                elif sort_by == "price_low_to_high":
-                    filtered_products = filter_module.sort_by_price_low_to_high(
-                        filtered_products
-                    )
-                elif sort_by == "popularity":
-                    filtered_products = filter_module.sort_by_popularity(
-                        filtered_products
-                    )
-
-                # Convert filtered products back to JSONL format
-                data = "\n".join([json.dumps(product) for product in filtered_products])
-            else:
+            filters = _get_current_filters()
+            if filters is not None:
+                filtered_products = _get_filtered_products(filters)
+
+                if use_gzip:
+                    data = _get_filtered_gzip(filters, filtered_products)
+                else:
+                    # Convert filtered products back to JSONL format
+                    data = _encode_jsonl(filtered_products)
+            elif use_gzip:
                 # No filters, return all data
-                with open("data.jsonl", "r") as f:
-                    data = f.read()
+                data = _get_raw_data_gzip()
+            else:
+                data = _get_raw_data()
 
             self.send_response(200)
             self.send_header("Content-type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.send_header("Vary", "Accept-Encoding")
+            if use_gzip:
+                self.send_header("Content-Encoding", "gzip")
             self.end_headers()
-            self.wfile.write(data.encode())
+            self.wfile.write(data)
         elif self.path.startswith("/api/products"):
             # Handle paginated product requests
             # Parse query parameters for page number
-            from urllib.parse import urlparse, parse_qs
-
             parsed_url = urlparse(self.path)
             query_params = parse_qs(parsed_url.query)
 
@@ -106,54 +343,14 @@ class Handler(SimpleHTTPRequestHandler):
             items_per_page = int(query_params.get("items_per_page", [50])[0])
 
             # Load and filter products (same logic as /data.jsonl)
-            if os.path.exists("current_filters.json"):
-                with open("current_filters.json", "r") as f:
-                    filters = json.load(f)
-
-                # Load all products
-                all_products = filter_module.load_products("data.jsonl")
-
-                # Apply filters
-                color = filters.get("color") or None
-                brand = filters.get("brand") or None
-                on_sale = (
-                    filters.get("on_sale")
-                    if filters.get("on_sale") is not None
-                    else None
-                )
-
-                # Parse price range
-                price_range = None
-                if filters.get("price_range"):
-                    price_parts = filters["price_range"].split("-")
-                    price_range = (float(price_parts[0]), float(price_parts[1]))
-
-                # Apply the filters
-                filtered_products = filter_module.apply_filters(
-                    all_products,
-                    color=color,
-                    price_range=price_range,
-                    on_sale=on_sale,
-                    brand=brand,
-                )
-
-                # Apply sorting if specified
-                sort_by = filters.get("sort_by")
-                if sort_by == "price_high_to_low":
-                    filtered_products = filter_module.sort_by_price_high_to_low(
-                        filtered_products
-                    )
-                elif sort_by == "price_low_to_high":
-                    filtered_products = filter_module.sort_by_price_low_to_high(
-                        filtered_products
-                    )
-                elif sort_by == "popularity":
-                    filtered_products = filter_module.sort_by_popularity(
-                        filtered_products
-                    )
+            filters = _get_current_filters()
+            if filters is not None:
+                # The result is shared with the filter cache, so pagination.py
+                # gets its own copy
+                filtered_products = list(_get_filtered_products(filters))
             else:
                 # No filters, load all products
-                filtered_products = filter_module.load_products("data.jsonl")
+                filtered_products = _get_products()
 
             # Apply pagination using pagination.py functions
             page_data = pagination_module.get_page_data(
@@ -164,12 +361,15 @@ class Handler(SimpleHTTPRequestHandler):
             )
 
             # Create response with both products and pagination info
-            response_data = {"products": page_data, "pagination": pagination_info}
+            response_data = orjson.dumps(
+                {"products": page_data, "pagination": pagination_info}
+            )
 
             self.send_response(200)
             self.send_header("Content-type", "application/json")
+            self.send_header("Content-Length", str(len(response_data)))
             self.end_headers()
-            self.wfile.write(json.dumps(response_data).encode())
+            self.wfile.write(response_data)
         else:
             super().do_GET()
 
@@ -178,32 +378,34 @@ class Handler(SimpleHTTPRequestHandler):
             # Read the filter data from the request
             content_length = int(self.headers["Content-Length"])
             post_data = self.rfile.read(content_length)
-            filters = json.loads(post_data.decode())
+            filters = orjson.loads(post_data)
 
-            # Save filters to a JSON file
-            with open("current_filters.json", "w") as f:
-                json.dump(filters, f)
+            # Keep the filters in memory for the following GET requests
+            _set_current_filters(filters)
 
             self.send_response(200)
             self.send_header("Content-type", "application/json")
             self.end_headers()
-            self.wfile.write(json.dumps({"status": "success"}).encode())
+            self.wfile.write(orjson.dumps({"status": "success"}))
         elif self.path == "/api/clear-filters":
-            # Remove the filters file
-            if os.path.exists("current_filters.json"):
-                os.remove("current_filters.json")
+            # Remove the active filters
+            _set_current_filters(None)
 
             self.send_response(200)
             self.send_header("Content-type", "application/json")
             self.end_headers()
-            self.wfile.write(json.dumps({"status": "success"}).encode())
+            self.wfile.write(orjson.dumps({"status": "success"}))
         else:
             self.send_response(404)
             self.end_headers()
 
 
+# Load the data before serving
+with _data_lock:
+    _refresh_data()
+
 server_address = ("", 3000)
-httpd = HTTPServer(server_address, Handler)
+httpd = ThreadingHTTPServer(server_address, Handler)
 
 # Set up file watcher for auto-reload
 observer = Observer()